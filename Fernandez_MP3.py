@@ -1,8 +1,16 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pv
 import plotly.express as px
+import plotly.graph_objects as go
+from numba import njit, prange
 import kagglehub
 import os
+import csv
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
 # PAGE CONFIGURATION
 
@@ -14,7 +22,71 @@ st.set_page_config(
 
 # DATA LOADING & CLEANING
 
-@st.cache_data
+# Cleaned data is persisted here so restarts skip the CSV parse entirely.
+# Bump CACHE_VERSION whenever the cleaning steps change to invalidate old files.
+CACHE_DIR = os.path.expanduser("~/.cache/manila_dash")
+CACHE_VERSION = 12
+
+@njit(parallel=True, cache=True)
+def parse_hours(offsets, data, out):
+    # Hour (0-23) of each "H:MM AM" / "HH:MM PM" string, or -1 if it does not parse.
+    # offsets/data are the raw buffers of an Arrow string array.
+    for i in prange(out.shape[0]):
+        out[i] = -1
+        pos = offsets[i]
+        end = offsets[i + 1]
+        while pos < end and data[pos] == 32:
+            pos += 1
+        while end > pos and data[end - 1] == 32:
+            end -= 1
+
+        # Hour: 1-2 digits in 1..12, then ':'
+        h = 0
+        n = 0
+        while pos < end and n < 2 and 48 <= data[pos] <= 57:
+            h = h * 10 + (data[pos] - 48)
+            pos += 1
+            n += 1
+        if n == 0 or h < 1 or h > 12 or pos >= end or data[pos] != 58:
+            continue
+        pos += 1
+
+        # Minutes: 1-2 digits in 0..59
+        m = 0
+        n = 0
+        while pos < end and n < 2 and 48 <= data[pos] <= 57:
+            m = m * 10 + (data[pos] - 48)
+            pos += 1
+            n += 1
+        if n == 0 or m > 59:
+            continue
+
+        # AM/PM marker (case-insensitive) must end the string
+        while pos < end and data[pos] == 32:
+            pos += 1
+        if end - pos != 2 or (data[pos + 1] | 32) != 109:
+            continue
+        marker = data[pos] | 32
+        if marker == 97:
+            out[i] = 0 if h == 12 else h
+        elif marker == 112:
+            out[i] = h if h == 12 else h + 12
+
+def time_to_hours(times):
+    # Run parse_hours over the bytes of a Series of time strings
+    arr = pa.array(times, type=pa.string(), from_pandas=True)
+    # Arrow-backed string columns (e.g. pandas 3 str after pd.concat) come back
+    # chunked; the kernel needs one contiguous offsets/data pair
+    if isinstance(arr, pa.ChunkedArray):
+        arr = arr.combine_chunks()
+    _, offsets_buf, data_buf = arr.buffers()
+    offsets = np.frombuffer(offsets_buf, dtype=np.int32)[arr.offset:arr.offset + len(arr) + 1]
+    data = np.frombuffer(data_buf, dtype=np.uint8) if data_buf is not None else np.zeros(0, dtype=np.uint8)
+    hours = np.empty(len(arr), dtype=np.int8)
+    parse_hours(offsets, data, hours)
+    return hours
+
+@st.cache_data(persist="disk")
 def load_and_clean_data():
     # --- DOWNLOAD VIA KAGGLEHUB ---
     with st.spinner("Downloading and combining all data files..."):
@@ -28,21 +100,57 @@ def load_and_clean_data():
             if not all_csv_files:
                 st.error("No CSV files found in the downloaded dataset.")
                 st.stop()
+
+            # Reuse the cleaned Parquet if the source files have not changed
+            file_stamps = "|".join(f"{p}:{os.path.getmtime(p)}" for p in sorted(all_csv_files))
+            key = hashlib.md5(f"v{CACHE_VERSION}|{file_stamps}".encode()).hexdigest()
+            cache_path = os.path.join(CACHE_DIR, f"{key}.parquet")
+            if os.path.exists(cache_path):
+                try:
+                    cached = pd.read_parquet(cache_path)
+                    cached.attrs['cache_key'] = key
+                    return cached
+                except Exception as e:
+                    # Unreadable cache file: rebuild it from the CSVs below
+                    st.warning(f"Could not read data cache, rebuilding: {e}")
             
             # Read and combine all CSVs into one DataFrame
-            df_list = []
-            for file in all_csv_files:
-                # Unicode escape handles encoding errors common in this dataset
+            def read_file(file):
+                # Errors are returned rather than reported, since st.* calls
+                # need the script thread and this runs inside the pool
                 try:
-                    temp_df = pd.read_csv(file, encoding='unicode_escape')
-                    df_list.append(temp_df)
+                    # Header names are stripped up front so they match what the cleaning expects
+                    with open(file, encoding='latin-1', newline='') as f:
+                        columns = [c.strip() for c in next(csv.reader(f))]
+                    # Latin-1 never fails to decode, so stray bytes in this dataset are kept as-is
+                    read_options = pv.ReadOptions(
+                        use_threads=True, encoding='latin-1', skip_rows=1, column_names=columns
+                    )
+                    # Every column is read as text so the yearly files always agree on types;
+                    # empty fields become nulls, as with pd.read_csv, so the fillna steps still apply
+                    convert_options = pv.ConvertOptions(
+                        strings_can_be_null=True, column_types={c: pa.string() for c in columns}
+                    )
+                    return pv.read_csv(file, read_options=read_options, convert_options=convert_options), None
                 except Exception as e:
-                    st.warning(f"Could not read file {file}: {e}")
+                    return None, e
+
+            # Files are parsed concurrently; PyArrow releases the GIL while parsing
+            with ThreadPoolExecutor(max_workers=min(8, len(all_csv_files))) as ex:
+                results = list(ex.map(read_file, all_csv_files))
+
+            df_list = []
+            for file, (table, error) in zip(all_csv_files, results):
+                if error is not None:
+                    st.warning(f"Could not read file {file}: {error}")
+                else:
+                    df_list.append(table.to_pandas())
             
             if not df_list:
                 st.error("No valid data files could be read.")
                 st.stop()
 
+            # Files from different years may not share the exact same columns
             df = pd.concat(df_list, ignore_index=True)
             
         except Exception as e:
@@ -58,28 +166,86 @@ def load_and_clean_data():
         df['City'] = df['City'].fillna('Unknown').astype(str).str.title().str.strip()
     
     # Fix Date (Handle mixed formats)
-    df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
+    # Kept as datetime64[ns] so the date filter can compare raw values
+    df['Date'] = pd.to_datetime(df['Date'], errors='coerce').astype('datetime64[ns]')
     df = df.dropna(subset=['Date'])
     
     # Fix Time and Hour extraction
-    df['Time'] = pd.to_datetime(df['Time'], format='%I:%M %p', errors='coerce').dt.time
-    df['Hour'] = pd.to_datetime(df['Time'].astype(str), errors='coerce').dt.hour
+    # Hours are parsed from the raw string bytes; unparseable times become NA
+    hours = time_to_hours(df['Time'])
+    df['Hour'] = pd.arrays.IntegerArray(hours, hours < 0)
+    df['Time'] = df['Time'].where(hours >= 0)
     
     # Fix Vehicle Types
     if 'Involved' in df.columns:
         df['Involved'] = df['Involved'].fillna("Unknown").astype(str)
     
-    # Ensure Coordinates exist for the map
+    # Ensure Coordinates exist for the map (non-numeric values count as missing)
+    df['Latitude'] = pd.to_numeric(df['Latitude'], errors='coerce')
+    df['Longitude'] = pd.to_numeric(df['Longitude'], errors='coerce')
     df = df.dropna(subset=['Latitude', 'Longitude'])
+
+    # float32 still resolves ~0.1m at Manila's latitude and halves the column size
+    df['Latitude'] = df['Latitude'].astype(np.float32)
+    df['Longitude'] = df['Longitude'].astype(np.float32)
     
-    # Create Month_Year for trend lines
-    df['Month_Year'] = df['Date'].dt.to_period('M').astype(str)
+    # Low-cardinality text columns as categories (small int codes instead of strings)
+    # City categories are sorted so the sidebar can list them as-is
+    df['City'] = pd.Categorical(df['City'], categories=sorted(df['City'].dropna().unique()), ordered=False)
+    if 'Involved' in df.columns:
+        df['Involved'] = df['Involved'].astype('category')
+    if 'Type' in df.columns:
+        df['Type'] = df['Type'].astype('category')
+
+    # Same 0..n-1 row labels whether the data came from the CSVs or the cache
+    df = df.reset_index(drop=True)
+    # Exact fingerprint of this data (source files + CACHE_VERSION) for downstream caches
+    df.attrs['cache_key'] = key
+
+    # Save cleaned data for the next cold start (failure here is not fatal)
+    # Written to a temp file first so an interrupted write never leaves a partial cache
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        df.to_parquet(tmp_path, compression='zstd', index=False)
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        st.warning(f"Could not write data cache: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
     return df
 
+def fast_count(arr):
+    # Distinct values of arr (sorted) and how often each occurs
+    u, inv = np.unique(arr, return_inverse=True)
+    return u, np.bincount(inv.ravel())
+
+# The four headline numbers only change when the filters or the data do, so they
+# are cached on the filter values plus data_id, the loader's fingerprint of the loaded
+# data. _filtered_df is excluded from hashing (leading underscore).
+@st.cache_data
+def compute_kpis(_filtered_df, data_id, start_date, end_date, cities):
+    def top_category(col):
+        # Most frequent category via one histogram over the codes (-1 = missing)
+        codes = col.cat.codes.values
+        counts = np.bincount(codes[codes >= 0], minlength=len(col.cat.categories))
+        return col.cat.categories[counts.argmax()] if counts.any() else "N/A"
+
+    total_incidents = len(_filtered_df)
+    top_city = top_category(_filtered_df['City'])
+    top_incident = top_category(_filtered_df['Type']) if 'Type' in _filtered_df.columns else "N/A"
+    hours = _filtered_df['Hour'].to_numpy(dtype=np.int8, na_value=-1)
+    hour_counts = np.bincount(hours[hours >= 0], minlength=24)
+    peak_hour_val = int(hour_counts.argmax()) if hour_counts.any() else "N/A"
+    return total_incidents, top_city, top_incident, peak_hour_val
+
 # Load Data
 df = load_and_clean_data()
 
+# Raw nanosecond view of Date for the filter mask (a zero-copy view of this rerun's df)
+date_ns = df['Date'].values.view('i8')
+
 # SIDEBAR FILTERS
 
 st.sidebar.header("Filter Traffic Data")
@@ -96,7 +262,7 @@ date_range = st.sidebar.date_input(
 )
 
 # City Filter
-cities = sorted(df['City'].unique().tolist())
+cities = list(df['City'].cat.categories)
 selected_cities = st.sidebar.multiselect("Select City", cities, default=cities[:5])
 
 # --- SMART DATE HANDLING (Fixes Index Error) ---
@@ -112,12 +278,19 @@ else:
     end_date = max_date
 
 # Apply Filters
+# End bound is exclusive midnight after end_date so the whole last day is kept
+start_ns = np.datetime64(start_date).astype('datetime64[ns]').astype(np.int64)
+end_ns = np.datetime64(end_date).astype('datetime64[ns]').astype(np.int64) + 86_400_000_000_000
+# Match cities on their category codes rather than comparing strings
+sel_codes = df['City'].cat.categories.get_indexer(selected_cities)
 mask = (
-    (df['Date'].dt.date >= start_date) &
-    (df['Date'].dt.date <= end_date) &
-    (df['City'].isin(selected_cities))
+    (date_ns >= start_ns) &
+    (date_ns < end_ns) &
+    np.isin(df['City'].cat.codes.values, sel_codes)
 )
-filtered_df = df.loc[mask]
+# Only the columns the dashboard reads are copied on each rerun
+ANALYSIS_COLS = ['Latitude', 'Longitude', 'Date', 'Hour', 'City', 'Involved', 'Type']
+filtered_df = df.loc[mask, [c for c in ANALYSIS_COLS if c in df.columns]]
 
 
 # MAIN DASHBOARD
@@ -125,13 +298,18 @@ filtered_df = df.loc[mask]
 st.title("🚦 Metro Manila Accident Dashboard")
 st.markdown("Analyzed from MMDA Traffic Incident Data via KaggleHub")
 
+# Nothing below works on an empty selection, so stop once here
+if filtered_df.empty:
+    st.warning("No data for selection.")
+    st.stop()
+
 # --- TOP METRICS ---
 col1, col2, col3, col4 = st.columns(4)
 
-total_incidents = len(filtered_df)
-top_city = filtered_df['City'].mode()[0] if not filtered_df.empty else "N/A"
-top_incident = filtered_df['Type'].mode()[0] if not filtered_df.empty and 'Type' in filtered_df.columns else "N/A"
-peak_hour_val = int(filtered_df['Hour'].mode()[0]) if not filtered_df.empty else "N/A"
+data_id = df.attrs['cache_key']
+total_incidents, top_city, top_incident, peak_hour_val = compute_kpis(
+    filtered_df, data_id, start_date, end_date, tuple(sorted(selected_cities))
+)
 peak_hour_str = f"{peak_hour_val}:00" if peak_hour_val != "N/A" else "N/A"
 
 # Metric 1
@@ -173,67 +351,94 @@ row1_col1, row1_col2 = st.columns([2, 1])
 
 with row1_col1:
     st.subheader("📍 Incident Hotspots")
-    if not filtered_df.empty:
-        # Using Plotly Density Mapbox 
-        fig_map = px.density_mapbox(
-            filtered_df,
-            lat='Latitude',
-            lon='Longitude',
-            z=None, # Heatmap based on density of points
-            radius=15,
-            center=dict(lat=filtered_df['Latitude'].mean(), lon=filtered_df['Longitude'].mean()),
-            zoom=10,
-            mapbox_style="carto-positron",
-            height=450
-        )
-        fig_map.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
-        st.plotly_chart(fig_map, use_container_width=True)
-    else:
-        st.info("No data available for the selected filters.")
+    # Snap points to a ~100m grid (0.001 deg) and send one weighted point per cell
+    lat_i = np.rint(filtered_df['Latitude'].values * 1000).astype(np.int64)
+    lon_i = np.rint(filtered_df['Longitude'].values * 1000).astype(np.int64)
+    cell = lat_i * 1_000_000 + (lon_i + 180_000)
+    _, first_idx, inv = np.unique(cell, return_index=True, return_inverse=True)
+    map_data = pd.DataFrame({
+        'Latitude': lat_i[first_idx] / 1000,
+        'Longitude': lon_i[first_idx] / 1000,
+        'w': np.bincount(inv.ravel()),
+    })
+
+    # Using Plotly Density Mapbox 
+    fig_map = px.density_mapbox(
+        map_data,
+        lat='Latitude',
+        lon='Longitude',
+        z='w', # Heatmap weighted by incidents per grid cell
+        radius=15,
+        center=dict(lat=filtered_df['Latitude'].mean(), lon=filtered_df['Longitude'].mean()),
+        zoom=10,
+        mapbox_style="carto-positron",
+        height=450
+    )
+    fig_map.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
+    st.plotly_chart(fig_map, use_container_width=True)
 
 with row1_col2:
     st.subheader("📈 Trend Over Time")
-    if not filtered_df.empty:
-        # Convert period to string for plotting compatibility
-        trend_data = filtered_df.groupby('Month_Year').size().reset_index(name='Count')
-        trend_data['Month_Year'] = trend_data['Month_Year'].astype(str)
-        
-        fig_trend = px.line(trend_data, x='Month_Year', y='Count', markers=True, template="plotly_dark")
-        st.plotly_chart(fig_trend, use_container_width=True)
+    # Truncate dates to months; fast_count returns them sorted with their counts
+    months = filtered_df['Date'].values.astype('datetime64[M]')
+    month_vals, month_counts = fast_count(months)
+    # Convert to string for plotting compatibility
+    trend_data = pd.DataFrame({
+        'Month_Year': np.datetime_as_string(month_vals, unit='M'),
+        'Count': month_counts,
+    })
+    
+    fig_trend = px.line(trend_data, x='Month_Year', y='Count', markers=True, template="plotly_dark")
+    st.plotly_chart(fig_trend, use_container_width=True)
 
 # --- ROW 2: HEATMAP & VEHICLES ---
 row2_col1, row2_col2 = st.columns(2)
 
 with row2_col1:
     st.subheader("⏰ The 'Danger Hour' Matrix")
-    if not filtered_df.empty:
-        filtered_df['Day_Name'] = filtered_df['Date'].dt.day_name()
-        heatmap_data = filtered_df.groupby(['Day_Name', 'Hour']).size().reset_index(name='Count')
-        days_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-        
-        fig_heat = px.density_heatmap(
-            heatmap_data, 
-            x='Hour', 
-            y='Day_Name', 
-            z='Count', 
-            nbinsx=24,
-            category_orders={'Day_Name': days_order},
-            color_continuous_scale='Reds',
-            template="plotly_dark"
-        )
-        st.plotly_chart(fig_heat, use_container_width=True)
+    days_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+    # Day of week straight from the nanosecond view (1970-01-01 was a Thursday, i.e. 3)
+    dow = ((date_ns[mask] // 86_400_000_000_000 + 3) % 7).astype(np.int8)
+    hr = filtered_df['Hour'].to_numpy(dtype=np.int8, na_value=-1)
+    valid = hr >= 0
+    # Count straight into a 7x24 grid (rows with no parsed hour are skipped)
+    counts = np.zeros((7, 24), dtype=np.int32)
+    np.add.at(counts, (dow[valid], hr[valid]), 1)
+    
+    # The grid is already binned, so plot it directly instead of re-binning with px
+    fig_heat = go.Figure(go.Heatmap(
+        z=counts,
+        x=list(range(24)),
+        y=days_order,
+        colorscale='Reds',
+        colorbar={'title': 'Count'}
+    ))
+    # Monday at the top, as the previous px.density_heatmap drew it
+    fig_heat.update_layout(
+        template="plotly_dark", xaxis_title='Hour', yaxis_title='Day_Name', yaxis_autorange='reversed'
+    )
+    st.plotly_chart(fig_heat, use_container_width=True)
 
 with row2_col2:
     st.subheader("🚗 Vehicles Involved")
-    if not filtered_df.empty:
-        # Get top 10 most common vehicle involvements
-        veh_counts = filtered_df['Involved'].value_counts().head(10).reset_index()
-        veh_counts.columns = ['Vehicle/s', 'Count']
-        
-        fig_bar = px.bar(veh_counts, x='Count', y='Vehicle/s', orientation='h', color='Count', template="plotly_dark")
-        fig_bar.update_layout(yaxis={'categoryorder':'total ascending'})
-        st.plotly_chart(fig_bar, use_container_width=True)
+    # Get top 10 most common vehicle involvements (counted over category codes)
+    codes = filtered_df['Involved'].cat.codes.values
+    veh_codes, cnt = fast_count(codes[codes >= 0])
+    top = np.argpartition(-cnt, min(10, len(cnt)) - 1)[:10]
+    top = top[np.argsort(-cnt[top], kind='stable')]
+    veh_counts = pd.DataFrame({
+        'Vehicle/s': df['Involved'].cat.categories[veh_codes[top]],
+        'Count': cnt[top],
+    })
+    
+    fig_bar = px.bar(veh_counts, x='Count', y='Vehicle/s', orientation='h', color='Count', template="plotly_dark")
+    fig_bar.update_layout(yaxis={'categoryorder':'total ascending'})
+    st.plotly_chart(fig_bar, use_container_width=True)
 
 # --- RAW DATA EXPANDER ---
 with st.expander("📂 View Raw Data Table"):
-    st.dataframe(filtered_df)
\ No newline at end of file
+    # The full rows are only copied out when asked for
+    if st.checkbox("Show all columns"):
+        st.dataframe(df.loc[mask])
+    else:
+        st.dataframe(filtered_df)
\ No newline at end of file